@@ -0,0 +1,286 @@
+# This file is part of ranger, the console file manager.
+# License: GNU GPL version 3, see the file "AUTHORS" for details.
+# Author: Emanuel Guevel, 2013
+# Author: Delisa Mason, 2015
+
+"""Interface for drawing images into the console
+
+This package provides functions to draw images in the terminal using supported
+implementations.  Each backend lives in its own submodule, which is only
+imported once the corresponding preview_images_method is actually requested.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import curses
+import fcntl
+import importlib
+import os
+import struct
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import termios
+from contextlib import contextmanager
+
+from ranger.core.shared import SettingsAware
+
+
+# Helper functions shared between the previewers (make them static methods of the base class?)
+
+
+@contextmanager
+def temporarily_moved_cursor(to_y, to_x):
+    """Common boilerplate code to move the cursor to a drawing area. Use it as:
+        with temporarily_moved_cursor(dest_y, dest_x):
+            your_func_here()"""
+    curses.putp(curses.tigetstr("sc"))
+    move_cur(to_y, to_x)
+    yield
+    curses.putp(curses.tigetstr("rc"))
+    sys.stdout.flush()
+
+
+# this is excised since Terminology needs to move the cursor multiple times
+def move_cur(to_y, to_x):
+    tparm = curses.tparm(curses.tigetstr("cup"), to_y, to_x)
+    # on python2 stdout is already in binary mode, in python3 is accessed via buffer
+    bin_stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    bin_stdout.write(tparm)
+
+
+def write_all(fd, payload):
+    """Write the whole payload to fd with os.write, looping on short writes.
+    Bypasses the TextIOWrapper/BufferedWriter stack (and its per-call
+    encoding) for escape sequences that are already composed as bytes."""
+    written = os.write(fd, payload)
+    while written < len(payload):
+        written += os.write(fd, payload[written:])
+
+
+def get_terminal_size():
+    farg = struct.pack("HHHH", 0, 0, 0, 0)
+    fd_stdout = sys.stdout.fileno()
+    fretint = fcntl.ioctl(fd_stdout, termios.TIOCGWINSZ, farg)
+    return struct.unpack("HHHH", fretint)
+
+
+# cached result of the TIOCGWINSZ ioctl; only a terminal resize can change
+# it, so the UI invalidates it from update_size() instead of paying the
+# ioctl on every preview.  A Python-level SIGWINCH handler would displace
+# the one ncurses installs, which is what turns resizes into KEY_RESIZE.
+_CACHED_FONT_DIMS = None
+_FONT_DIMS_GENERATION = 0
+
+
+def get_font_dimensions():
+    """
+    Get the height and width of a character displayed in the terminal in
+    pixels.
+    """
+    global _CACHED_FONT_DIMS  # pylint: disable=global-statement
+    if _CACHED_FONT_DIMS is None:
+        rows, cols, xpixels, ypixels = get_terminal_size()
+        _CACHED_FONT_DIMS = (xpixels // cols), (ypixels // rows)
+    return _CACHED_FONT_DIMS
+
+
+def invalidate_font_dimensions():
+    """Drop the cached font dimensions after a terminal resize."""
+    global _CACHED_FONT_DIMS, _FONT_DIMS_GENERATION  # pylint: disable=global-statement
+    _CACHED_FONT_DIMS = None
+    _FONT_DIMS_GENERATION += 1
+
+
+def font_dimensions_generation():
+    """A counter bumped on every resize, for displayers that keep their own
+    derived values and need to know when those went stale."""
+    return _FONT_DIMS_GENERATION
+
+
+def image_fit_width(
+    width, height, max_cols, max_rows, *, font_width=None, font_height=None
+):
+    if font_width is None or font_height is None:
+        font_width, font_height = get_font_dimensions()
+
+    max_width = font_width * max_cols
+    max_height = font_height * max_rows
+    if height > max_height:
+        if width > max_width:
+            width_scale = max_width / width
+            height_scale = max_height / height
+            min_scale = min(width_scale, height_scale)
+            return width * min_scale
+        else:
+            scale = max_height / height
+            return width * scale
+    elif width > max_width:
+        scale = max_width / width
+        return width * scale
+    else:
+        return width
+
+
+def sniff_image_type(header):
+    """Detect the image type from an already-read file header."""
+    if header[6:10] in (b'JFIF', b'Exif'):
+        return 'jpeg'
+    elif header[:4] == b'\xff\xd8\xff\xdb':
+        return 'jpeg'
+    elif header.startswith(b'\211PNG\r\n\032\n'):
+        return 'png'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    else:
+        return None
+
+
+def probe_image_size(path):
+    """Determine image size from the file header, without decoding any pixel
+    data.  Returns (0, 0) for formats this cannot parse."""
+    with open(path, 'rb') as file_handle:
+        file_header = file_handle.read(32)
+        image_type = sniff_image_type(file_header)
+        if len(file_header) < 24:
+            return 0, 0
+        if image_type == 'png':
+            check = struct.unpack('>i', file_header[4:8])[0]
+            if check != 0x0d0a1a0a:
+                return 0, 0
+            width, height = struct.unpack('>ii', file_header[16:24])
+        elif image_type == 'gif':
+            width, height = struct.unpack('<HH', file_header[6:10])
+        elif image_type == 'jpeg':
+            # scan the marker segments in buffered 64 KiB reads instead of
+            # a pair of syscalls per marker byte; the SOF marker carrying
+            # the dimensions usually sits in the first chunk, but large
+            # EXIF or ICC segments can push it further out
+            file_handle.seek(0)
+            data = file_handle.read(65536)
+            try:
+                index = 2  # skip the SOI marker
+                while True:
+                    while len(data) < index + 10:
+                        # the next marker header is not buffered yet
+                        chunk = file_handle.read(65536)
+                        if not chunk:
+                            raise ValueError('truncated JPEG header')
+                        data += chunk
+                    index = data.index(b'\xff', index)
+                    while data[index] == 0xff:
+                        index += 1
+                    marker = data[index]
+                    if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+                        height, width = struct.unpack(
+                            '>HH', data[index + 4:index + 8])
+                        break
+                    index += 1 + struct.unpack('>H', data[index + 1:index + 3])[0]
+            except (ValueError, IndexError, struct.error):
+                height, width = 0, 0
+        else:
+            return 0, 0
+    return width, height
+
+
+def neighbor_image_paths(fm, count=2):
+    """Paths of the image files just before and after the current selection,
+    which the user is most likely to ask a preview for next."""
+    directory = fm.thisdir
+    if directory is None or not directory.files:
+        return []
+    pointer = directory.pointer
+    neighbors = []
+    for offset in range(1, count + 1):
+        for index in (pointer + offset, pointer - offset):
+            if 0 <= index < len(directory.files):
+                fobj = directory.files[index]
+                if fobj.image:
+                    neighbors.append(fobj.path)
+    return neighbors
+
+
+def make_prefetch_pool():
+    """A small thread pool for rendering previews the user has not asked for
+    yet.  PIL and subprocess waits release the GIL, so the workers overlap
+    nicely with the UI thread."""
+    return ThreadPoolExecutor(max_workers=(os.cpu_count() or 2) // 2 or 1)
+
+
+class ImageDisplayError(Exception):
+    pass
+
+
+class ImgDisplayUnsupportedException(Exception, SettingsAware):
+    def __init__(self, message=None):
+        if message is None:
+            message = (
+                '"{0}" does not appear to be a valid setting for'
+                ' preview_images_method.'
+            ).format(self.settings.preview_images_method)
+        super(ImgDisplayUnsupportedException, self).__init__(message)
+
+
+def fallback_image_displayer():
+    """Simply makes some noise when chosen. Temporary fallback behavior."""
+
+    raise ImgDisplayUnsupportedException
+
+
+IMAGE_DISPLAYER_REGISTRY = defaultdict(fallback_image_displayer)
+
+# Which submodule registers the displayer for each nickname.  Importing all
+# backends up front would drag in PIL, mmap & friends even for users whose
+# preview_images_method never needs them, so they are loaded on demand.
+IMAGE_DISPLAYER_MODULES = {
+    "w3m": "w3m",
+    "iterm2": "iterm2",
+    "sixel": "sixel",
+    "terminology": "terminology",
+    "urxvt": "urxvt",
+    "urxvt-full": "urxvt",
+    "kitty": "kitty",
+    "ueberzug": "ueberzug",
+}
+
+
+def register_image_displayer(nickname=None):
+    """Register an ImageDisplayer by nickname if available."""
+
+    def decorator(image_displayer_class):
+        if nickname:
+            registry_key = nickname
+        else:
+            registry_key = image_displayer_class.__name__
+        IMAGE_DISPLAYER_REGISTRY[registry_key] = image_displayer_class
+        return image_displayer_class
+    return decorator
+
+
+def get_image_displayer(registry_key):
+    if registry_key not in IMAGE_DISPLAYER_REGISTRY:
+        module_name = IMAGE_DISPLAYER_MODULES.get(registry_key)
+        if module_name is not None:
+            importlib.import_module('.' + module_name, __package__)
+    image_displayer_class = IMAGE_DISPLAYER_REGISTRY[registry_key]
+    return image_displayer_class()
+
+
+class ImageDisplayer(object):
+    """Image display provider functions for drawing images in the terminal"""
+
+    working_dir = os.environ.get('XDG_RUNTIME_DIR', os.path.expanduser("~") or None)
+
+    # pylint: disable=too-many-positional-arguments
+    def draw(self, path, start_x, start_y, width, height):
+        """Draw an image at the given coordinates."""
+
+    def clear(self, start_x, start_y, width, height):
+        """Clear a part of terminal display."""
+
+    def quit(self):
+        """Cleanup and close"""
+
+# TODO: remove FileManagerAwareness, as stuff in ranger.ext should be
+# ranger-independent libraries.
@@ -0,0 +1,144 @@
+# This file is part of ranger, the console file manager.
+# License: GNU GPL version 3, see the file "AUTHORS" for details.
+
+"""Image display using the iTerm2 inline image protocol"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import base64
+import mmap
+import os
+import sys
+from subprocess import check_call, CalledProcessError
+
+from ranger.core.shared import FileManagerAware
+from ranger.ext.popen23 import DEVNULL
+from ranger.ext.which import which
+
+from . import (
+    ImageDisplayer,
+    image_fit_width,
+    probe_image_size,
+    register_image_displayer,
+    sniff_image_type,
+    temporarily_moved_cursor,
+)
+
+
+@register_image_displayer("iterm2")
+class ITerm2ImageDisplayer(ImageDisplayer, FileManagerAware):
+    """Implementation of ImageDisplayer using iTerm2 image display support
+    (http://iterm2.com/images.html).
+
+    Ranger must be running in iTerm2 for this to work.
+    """
+
+    # smallest payload for which forking an external encoder pays off
+    external_base64_threshold = 1024 * 1024
+    # resolved on first use; None when no suitable base64 binary exists
+    _base64_cmd = False
+
+    # pylint: disable=too-many-positional-arguments
+    def draw(self, path, start_x, start_y, width, height):
+        with temporarily_moved_cursor(start_y, start_x):
+            self._write_iterm2_image(path, width, height)
+
+    def clear(self, start_x, start_y, width, height):
+        self.fm.ui.win.redrawwin()
+        self.fm.ui.win.refresh()
+
+    def quit(self):
+        self.clear(0, 0, 0, 0)
+
+    def _write_iterm2_image(self, path, max_cols, max_rows):
+        """Write the iTerm2 inline-image sequence for path to the binary
+        stdout buffer: header, base64 payload and trailer go out as separate
+        writes, so the payload is never copied into an intermediate str."""
+        image_width, image_height = self._get_image_dimensions(path)
+        if max_cols == 0 or max_rows == 0 or image_width == 0 or image_height == 0:
+            return
+        image_width = self._fit_width(
+            image_width, image_height, max_cols, max_rows)
+        try:
+            byte_size = os.stat(path).st_size
+        except OSError:
+            return
+        if byte_size == 0:
+            return
+        display_protocol = b"\033"
+        close_protocol = b"\a"
+        if os.environ["TERM"].startswith(("screen", "tmux")):
+            display_protocol += b"Ptmux;\033\033"
+            close_protocol += b"\033\\"
+
+        stdbout = getattr(sys.stdout, 'buffer', sys.stdout)
+        stdbout.write(
+            b"%s]1337;File=inline=1;preserveAspectRatio=0;size=%d;width=%dpx:" % (
+                display_protocol, byte_size, int(image_width)))
+        if not self._write_payload_external(path, byte_size, stdbout):
+            content, _ = self._encode_image_content(path)
+            stdbout.write(content)
+        stdbout.write(close_protocol + b"\n")
+
+    @classmethod
+    def _base64_command(cls):
+        """The external base64 command line, probed once per session.  Only
+        GNU coreutils base64 (which takes --version and -w0 for unwrapped
+        output) qualifies; with any other implementation this stays None."""
+        if cls._base64_cmd is False:
+            cls._base64_cmd = None
+            if which("base64"):
+                try:
+                    check_call(["base64", "--version"],
+                               stdout=DEVNULL, stderr=DEVNULL)
+                except (CalledProcessError, OSError):
+                    pass
+                else:
+                    cls._base64_cmd = ["base64", "-w0"]
+        return cls._base64_cmd
+
+    def _write_payload_external(self, path, byte_size, stdbout):
+        """Pipe path through the external base64, whose vectorized C encoder
+        beats base64.b64encode for payloads big enough to amortize the fork.
+        Returns False when the in-process encoder should be used instead."""
+        if byte_size < self.external_base64_threshold:
+            return False
+        base64_cmd = self._base64_command()
+        if base64_cmd is None:
+            return False
+        stdbout.flush()
+        try:
+            with open(path, 'rb') as fobj:
+                check_call(base64_cmd, stdin=fobj, stdout=stdbout)
+        except (OSError, CalledProcessError):
+            return False
+        return True
+
+    def _fit_width(self, width, height, max_cols, max_rows):
+        return image_fit_width(
+            width, height, max_cols, max_rows,
+            font_width=self.fm.settings.iterm2_font_width,
+            font_height=self.fm.settings.iterm2_font_height
+        )
+
+    @staticmethod
+    def _encode_image_content(path):
+        """Read and base64-encode the contents of path as bytes"""
+        with open(path, 'rb') as fobj:
+            byte_size = os.fstat(fobj.fileno()).st_size
+            if byte_size == 0:
+                return b'', 0
+            # map the file instead of slurping it: base64.b64encode accepts
+            # the buffer protocol, so only the encoded copy is materialized
+            with mmap.mmap(fobj.fileno(), 0, prot=mmap.PROT_READ) as content:
+                return base64.b64encode(content), byte_size
+
+    @staticmethod
+    def imghdr_what(path):
+        """Replacement for the deprecated imghdr module"""
+        with open(path, "rb") as img_file:
+            return sniff_image_type(img_file.read(32))
+
+    # the header parsers now live in the package so w3m can share them
+    _sniff = staticmethod(sniff_image_type)
+    _get_image_dimensions = staticmethod(probe_image_size)
@@ -0,0 +1,431 @@
+# This file is part of ranger, the console file manager.
+# License: GNU GPL version 3, see the file "AUTHORS" for details.
+
+"""Image display using the kitty graphics protocol"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import base64
+import codecs
+import os
+import select
+import sys
+import warnings
+from collections import namedtuple, OrderedDict
+from tempfile import gettempdir, NamedTemporaryFile
+
+from ranger.core.shared import FileManagerAware
+
+from . import (
+    ImageDisplayer,
+    ImageDisplayError,
+    ImgDisplayUnsupportedException,
+    get_font_dimensions,
+    make_prefetch_pool,
+    neighbor_image_paths,
+    register_image_displayer,
+    temporarily_moved_cursor,
+)
+
+
+_CacheableKittyImage = namedtuple(
+    "_CacheableKittyImage", ("inode", "mtime", "width", "height"))
+
+_CachedKittyImage = namedtuple("_CachedKittyImage", ("image_id", "cmds", "payload"))
+
+
+@register_image_displayer("kitty")
+class KittyImageDisplayer(  # pylint: disable=too-many-instance-attributes
+        ImageDisplayer, FileManagerAware):
+    """Implementation of ImageDisplayer for kitty (https://github.com/kovidgoyal/kitty/)
+    terminal. It uses the built APC to send commands and data to kitty,
+    which in turn renders the image. The APC takes the form
+    '\033_Gk=v,k=v...;bbbbbbbbbbbbbb\033\\'
+       |   ---------- --------------  |
+    escape code  |             |    escape code
+                 |  base64 encoded payload
+        key: value pairs as parameters
+    For more info please head over to :
+        https://github.com/kovidgoyal/kitty/blob/master/graphics-protocol.asciidoc"""
+    protocol_start = b'\x1b_G'
+    protocol_end = b'\x1b\\'
+    # we are going to use stdio in binary mode a lot, so due to py2 -> py3
+    # differences is worth to do this:
+    stdbout = getattr(sys.stdout, 'buffer', sys.stdout)
+    stdbin = getattr(sys.stdin, 'buffer', sys.stdin)
+    # counter for image ids on kitty's end
+    image_id = 0
+    # number of transmitted images kept referenced for quick re-placement
+    cache_size = 32
+    # we need to find out the encoding for a path string, ascii won't cut it
+    try:
+        fsenc = sys.getfilesystemencoding()  # returns None if standard utf-8 is used
+        # throws LookupError if can't find the codec, TypeError if fsenc is None
+        codecs.lookup(fsenc)
+    except (LookupError, TypeError):
+        fsenc = 'utf-8'
+
+    def __init__(self):
+        # the rest of the initializations that require reading stdio or raising exceptions
+        # are delayed to the first draw call, since curses
+        # and ranger exception handler are not online at __init__() time
+        self.needs_late_init = True
+        # to init in _late_init()
+        self.backend = None
+        self.vips = None
+        self.stream = None
+        self.pix_row, self.pix_col = (0, 0)
+        self.temp_file_dir = None  # Only used when streaming is not an option
+        # rendered payloads and the kitty-side ids they were transmitted
+        # under, keyed by inode, mtime and the pixel box they were fit to;
+        # ordered oldest-used first so eviction is a popitem(last=False)
+        self.cache = OrderedDict()
+        self._displayed_id = None
+        self._prefetch_pool = make_prefetch_pool()
+        self.fm.signal_bind('preview.cleared', lambda signal: self._clear_cache(signal.path))
+
+    def _clear_cache(self, path):
+        if os.path.exists(path):
+            inode = os.stat(path).st_ino
+            for cacheable in [ce for ce in self.cache if ce.inode == inode]:
+                cached = self.cache.pop(cacheable)
+                if cached.image_id is not None:
+                    self._free_image(cached.image_id)
+                else:
+                    self._discard_payload(cached)
+            self.stdbout.flush()
+
+    @staticmethod
+    def _discard_payload(cached):
+        """Remove the temporary file backing a never-transmitted payload.
+        kitty unlinks 't=t' files only once they are transmitted, so entries
+        the prefetcher rendered but draw never picked up have to clean up
+        after themselves."""
+        if cached.image_id is None and cached.cmds.get('t') == 't':
+            try:
+                os.remove(cached.payload)
+            except OSError:
+                pass
+
+    def _free_image(self, image_id):
+        """Ask kitty to drop the data it stored for image_id."""
+        self.stdbout.write(b''.join(
+            self._format_cmd_str({'a': 'd', 'd': 'I', 'i': image_id})))
+
+    def _late_init(self):
+        # query terminal for kitty graphics protocol support
+        # https://sw.kovidgoyal.net/kitty/graphics-protocol/#querying-support-and-available-transmission-mediums
+        # combined with automatic check if we share the filesystem using a dummy file
+        with NamedTemporaryFile() as tmpf:
+            tmpf.write(bytearray([0xFF] * 3))
+            tmpf.flush()
+            # kitty graphics protocol query
+            self.stdbout.write(b''.join(self._format_cmd_str(
+                {'a': 'q', 'i': 1, 'f': 24, 't': 'f', 's': 1, 'v': 1, 'S': 3},
+                payload=tmpf.name.encode(self.fsenc))))
+            sys.stdout.flush()
+            # VT100 Primary Device Attributes (DA1) query
+            self.stdbout.write(b'\x1b[c')
+            sys.stdout.flush()
+            # read response(s); DA1 response should always be last
+            #                            (DA1 resp start   )     (DA1 resp end     )
+            resp = self._read_response(lambda r: (b'\x1b[?' in r) and (r[-1:] == b'c'))
+
+        # check whether kitty graphics protocol query was acknowledged
+        # NOTE: this catches tmux too, no special case needed!
+        if not resp.startswith(self.protocol_start):
+            raise ImgDisplayUnsupportedException(
+                'terminal did not respond to kitty graphics query; disabling')
+        # strip resp down to just the kitty graphics protocol response
+        resp = resp[:resp.find(self.protocol_end) + 1]
+
+        # set the transfer method based on the response
+        # if resp.find(b'OK') != -1:
+        if b'OK' in resp:
+            self.stream = False
+            self.temp_file_dir = os.path.join(
+                gettempdir(), "tty-graphics-protocol"
+            )
+            try:
+                os.mkdir(self.temp_file_dir)
+            except OSError:
+                # COMPAT: Python 2.7 does not define FileExistsError so we have
+                # to check whether the problem is the directory already being
+                # present. This is prone to race conditions, TOCTOU.
+                if not os.path.isdir(self.temp_file_dir):
+                    raise ImgDisplayUnsupportedException(
+                        "Could not create temporary directory for previews : {d}".format(
+                            d=self.temp_file_dir
+                        )
+                    )
+        elif b'EBADF' in resp:
+            self.stream = True
+        else:
+            raise ImgDisplayUnsupportedException(
+                'unexpected response from terminal emulator: {r}'.format(r=resp))
+
+        # get the image manipulation backend
+        try:
+            # pillow is the default since we are not going
+            # to spawn other processes, so it _should_ be faster
+            import PIL.Image
+            self.backend = PIL.Image
+        except ImportError:
+            raise ImageDisplayError("previews using kitty graphics require PIL (pillow)")
+            # TODO: implement a wrapper class for Imagemagick process to
+            # replicate the functionality we use from im
+        try:
+            # libvips thumbnails demand-driven with SIMD resampling and never
+            # decodes the full source image; prefer it when it is installed
+            import pyvips
+            self.vips = pyvips
+        except ImportError:
+            self.vips = None
+
+        # get dimensions of a cell in pixels
+        self.pix_row, self.pix_col = get_font_dimensions()
+        self.needs_late_init = False
+
+    def _read_response(self, complete, timeout=2.0):
+        """Read the terminal's reply from stdin in bulk until the complete
+        predicate accepts the bytes gathered so far.  A select timeout raises
+        instead of hanging the UI when the terminal never answers (stale
+        connection, tmux swallowing the passthrough, ...)."""
+        fd = self.stdbin.fileno()
+        resp = b''
+        while not complete(resp):
+            ready, _, _ = select.select([fd], [], [], timeout)
+            if not ready:
+                raise ImageDisplayError(
+                    'terminal did not respond to kitty graphics command')
+            resp += os.read(fd, 4096)
+        return resp
+
+    # pylint: disable=too-many-positional-arguments,too-many-locals
+    def draw(self, path, start_x, start_y, width, height):
+        # sys.stderr.write('{0}-{1}@{2}x{3}\t'.format(
+        #     start_x, start_y, width, height))
+
+        # finish initialization if it is the first call
+        if self.needs_late_init:
+            self._late_init()
+
+        # cached module-side, so this only costs an ioctl right after a resize
+        self.pix_row, self.pix_col = get_font_dimensions()
+        box = (width * self.pix_row, height * self.pix_col)
+        path_stat = os.stat(path)
+        cacheable = _CacheableKittyImage(
+            path_stat.st_ino, path_stat.st_mtime_ns, box[0], box[1])
+
+        cached = self.cache.get(cacheable)
+        if cached is None or cached.image_id is None:
+            if cached is None:
+                cmds_stub, payload = self._render_payload(path, box)
+            else:
+                # the prefetcher already rendered this one; it only remains
+                # to transmit it under a fresh id
+                cmds_stub, payload = cached.cmds, cached.payload
+            self.image_id += 1
+            # dictionary to store the command arguments for kitty
+            # a is the display command, with T going for immediate output
+            # i is the identifier for the image
+            cmds = {'a': 'T', 'i': self.image_id}
+            cmds.update(cmds_stub)
+        else:
+            self.cache.move_to_end(cacheable)
+            # kitty still holds the transmitted data, so skip the whole
+            # PIL/base64 pipeline and just place the image again by its id
+            cmds = {'a': 'p', 'i': cached.image_id}
+            cmds_stub = None
+            payload = None
+        self._displayed_id = cmds['i']
+
+        # warm the cache for the files the cursor is likely to hit next while
+        # the tty write and the acknowledgment round-trip happen
+        for neighbor in neighbor_image_paths(self.fm):
+            self._prefetch_pool.submit(self._prefetch, neighbor, box)
+
+        with temporarily_moved_cursor(int(start_y), int(start_x)):
+            # concatenate all frames and hand them to the tty in one write
+            # instead of traversing the I/O stack once per 2 KiB slice
+            self.stdbout.write(b''.join(self._format_cmd_str(cmds, payload=payload)))
+        # catch kitty answer before the escape codes corrupt the console
+        resp = self._read_response(lambda r: r[-2:] == self.protocol_end)
+        if b'OK' not in resp:
+            raise ImageDisplayError('kitty graphics protocol replied "{r}"'.format(r=resp))
+        if cmds_stub is not None:
+            # only now does kitty hold the data under this id; caching it
+            # before the acknowledgment would leave an entry whose 'a=p'
+            # placements fail forever when the transmit goes wrong.  The
+            # payload is not kept either: kitty's copy serves re-placement,
+            # bytes stay only on prefetch entries awaiting transmission.
+            self.cache[cacheable] = _CachedKittyImage(self.image_id, cmds_stub, None)
+            self.cache.move_to_end(cacheable)
+            while len(self.cache) > self.cache_size:
+                # evict the least recently used entry and free the copy
+                # kitty keeps, so its memory does not grow unboundedly
+                _, evicted = self.cache.popitem(last=False)
+                if evicted.image_id is not None:
+                    self._free_image(evicted.image_id)
+                else:
+                    self._discard_payload(evicted)
+
+    def _prefetch(self, path, box):
+        """Render path into the cache from a worker thread, with image_id
+        left unset: transmission must happen on the UI thread, where draw
+        picks the rendered payload up.  Failures for files nobody asked to
+        see yet are not worth reporting."""
+        try:
+            path_stat = os.stat(path)
+            cacheable = _CacheableKittyImage(
+                path_stat.st_ino, path_stat.st_mtime_ns, box[0], box[1])
+            if cacheable in self.cache:
+                return
+            cmds_stub, payload = self._render_payload(path, box)
+        except (ImageDisplayError, OSError):
+            return
+        entry = _CachedKittyImage(None, cmds_stub, payload)
+        if self.cache.setdefault(cacheable, entry) is not entry:
+            # lost the race against another render of the same file; drop
+            # this copy's backing file instead of leaking it
+            self._discard_payload(entry)
+
+    def _render_payload(self, path, box):
+        """Open the image at path, fit it to the pixel box and return the
+        kitty transmission command stub along with the raw payload."""
+        if self.stream and self.vips is not None:
+            rendered = self._render_payload_vips(path, box)
+            if rendered is not None:
+                return rendered
+
+        with warnings.catch_warnings(record=True):  # as warn:
+            warnings.simplefilter('ignore', self.backend.DecompressionBombWarning)
+            image = self.backend.open(path)
+            # TODO: find a way to send a message to the user that
+            # doesn't stop the image from displaying
+            # if warn:
+            #     raise ImageDisplayError(str(warn[-1].message))
+
+        needs_resize = image.width > box[0] or image.height > box[1]
+        if not self.stream and not needs_resize and image.format == 'PNG':
+            # the file is a PNG that already fits the box: have kitty read it
+            # from disk directly ('t=f' keeps the file around), skipping the
+            # decode, resize and re-encode roundtrip entirely.  PIL.Image.open
+            # is lazy, so only the header was parsed to get this far.
+            return {'t': 'f', 'f': 100}, path.encode(self.fsenc)
+
+        if needs_resize:
+            scale = min(box[0] / image.width, box[1] / image.height)
+            image = image.resize((int(scale * image.width), int(scale * image.height)),
+                                 self.backend.LANCZOS)  # pylint: disable=no-member
+
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert(
+                "RGBA" if "transparency" in image.info else "RGB"
+            )
+        # start_x += ((box[0] - image.width) // 2) // self.pix_row
+        # start_y += ((box[1] - image.height) // 2) // self.pix_col
+        if self.stream:
+            # send the raw pixel buffer; _format_cmd_str base64-encodes it
+            # chunk by chunk while framing the APC messages
+            # TODO: implement z compression
+            # to possibly increase resolution in sent image
+            # t: transmissium medium, 'd' for embedded
+            # f: size of a pixel fragment (8bytes per color)
+            # s, v: size of the image to recompose the flattened data
+            # c, r: size in cells of the viewbox
+            cmds = {'t': 'd', 'f': 32 if image.mode == 'RGBA' else 24,
+                    's': image.width, 'v': image.height, }
+            # tobytes() hands us the packed RGB(A) buffer straight from
+            # libImaging instead of materializing one tuple per pixel
+            payload = image.tobytes()
+        else:
+            # put the raw pixel buffer in a temporary file
+            # t: transmissium medium, 't' for temporary file (kitty will delete it for us)
+            # f: size of a pixel fragment; raw RGB(A) spares us the PNG
+            #       filter+deflate work (the bulk of a PNG save even at
+            #       compress_level=0) for a file that only lives seconds
+            # s, v: size of the image to recompose the flattened data
+            # c, r: size in cells of the viewbox
+            cmds = {'t': 't', 'f': 32 if image.mode == 'RGBA' else 24,
+                    's': image.width, 'v': image.height, }
+            with NamedTemporaryFile(
+                prefix='ranger_thumb_',
+                suffix='.raw',
+                dir=self.temp_file_dir,
+                delete=False,
+            ) as tmpf:
+                tmpf.write(image.tobytes())
+                payload = tmpf.name.encode(self.fsenc)
+
+        return cmds, payload
+
+    def _render_payload_vips(self, path, box):
+        """Thumbnail path with libvips, whose packed uchar buffer matches the
+        raw RGB(A) layout kitty expects.  Returns None if vips cannot handle
+        the file, so the PIL pipeline can have a go at it (and report the
+        failure)."""
+        try:
+            thumb = self.vips.Image.thumbnail(path, box[0], height=box[1], size='down')
+            if thumb.bands not in (3, 4):
+                thumb = thumb.colourspace('srgb')
+            if thumb.format != 'uchar':
+                thumb = thumb.cast('uchar')
+        except self.vips.Error:
+            return None
+        if thumb.bands not in (3, 4):
+            return None
+        return ({'t': 'd', 'f': thumb.bands * 8,
+                 's': thumb.width, 'v': thumb.height, },
+                thumb.write_to_memory())
+
+    def clear(self, start_x, start_y, width, height):
+        # let's assume that every time ranger call this
+        # it actually wants just to remove the previous image
+        # TODO: implement this using the actual x, y, since the protocol
+        #       supports it
+        if self._displayed_id is not None:
+            # 'd=i' removes the placement but keeps the transmitted data
+            # addressable, so drawing the same image again is a cheap 'a=p'
+            cmds = {'a': 'd', 'd': 'i', 'i': self._displayed_id}
+            self.stdbout.write(b''.join(self._format_cmd_str(cmds)))
+            self.stdbout.flush()
+            # kitty doesn't seem to reply on deletes, checking like we do in
+            # draw() will slows down scrolling with timeouts from select
+            self._displayed_id = None
+        self.fm.ui.win.redrawwin()
+        self.fm.ui.win.refresh()
+
+    def _format_cmd_str(self, cmd, payload=None, max_slice_len=1536):
+        """Yield the APC escape sequences for cmd, base64-encoding the raw
+        payload chunk by chunk: 1536 raw bytes encode to exactly 2048 base64
+        bytes, so no fully encoded copy of the payload is ever built."""
+        central_blk = ','.join(['%s=%s' % kv for kv in cmd.items()]).encode('ascii')
+        if payload is not None:
+            # we add the m key to signal a multiframe communication
+            # appending the end (m=0) key to a single message has no effect;
+            # the frame headers are identical for every slice, so build them
+            # once instead of re-joining the command dict per 2 KiB frame
+            header_mid = self.protocol_start + central_blk + b',m=1;'
+            header_end = self.protocol_start + central_blk + b',m=0;'
+            view = memoryview(payload)
+            for start in range(0, len(view), max_slice_len):
+                payload_blk = base64.standard_b64encode(
+                    view[start:start + max_slice_len])
+                header = header_mid if start + max_slice_len < len(view) else header_end
+                yield header + payload_blk + self.protocol_end
+        else:
+            yield self.protocol_start + central_blk + b';' + self.protocol_end
+
+    def quit(self):
+        # free every image we transmitted on kitty's side, then drop the cache
+        self._prefetch_pool.shutdown(wait=False)
+        for cached in self.cache.values():
+            if cached.image_id is not None:
+                self._free_image(cached.image_id)
+            else:
+                self._discard_payload(cached)
+        self.stdbout.flush()
+        self.image_id = 0
+        self._displayed_id = None
+        self.cache = OrderedDict()
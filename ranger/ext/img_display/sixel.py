@@ -0,0 +1,378 @@
+# This file is part of ranger, the console file manager.
+# License: GNU GPL version 3, see the file "AUTHORS" for details.
+
+"""Image display using the SIXEL protocol, rendered with ImageMagick"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import hashlib
+import mmap
+import os
+import select
+import sys
+import threading
+from collections import namedtuple
+from subprocess import Popen, PIPE
+from tempfile import NamedTemporaryFile
+
+import ranger
+from ranger import PY3
+from ranger.core.shared import FileManagerAware
+from ranger.ext.popen23 import Popen23, DEVNULL
+from ranger.ext.which import which
+
+from . import (
+    ImageDisplayer,
+    ImageDisplayError,
+    get_font_dimensions,
+    make_prefetch_pool,
+    neighbor_image_paths,
+    register_image_displayer,
+    temporarily_moved_cursor,
+)
+
+
+MAGICK_CONVERT_CMD_BASE = None
+
+
+def magick_cmd():
+    """The ImageMagick command base, resolved on first use so importing the
+    module does not walk PATH."""
+    global MAGICK_CONVERT_CMD_BASE  # pylint: disable=global-statement
+    if MAGICK_CONVERT_CMD_BASE is None:
+        if which("magick"):
+            # Magick >= 7
+            MAGICK_CONVERT_CMD_BASE = ("magick",)
+        else:
+            # Magick < 7
+            MAGICK_CONVERT_CMD_BASE = ("convert",)
+    return MAGICK_CONVERT_CMD_BASE
+
+
+_CacheableSixelImage = namedtuple("_CacheableSixelImage", ("width", "height", "inode"))
+
+_CachedSixelImage = namedtuple("_CachedSixelImage", ("image", "fh"))
+
+
+@register_image_displayer("sixel")
+class SixelImageDisplayer(  # pylint: disable=too-many-instance-attributes
+        ImageDisplayer, FileManagerAware):
+    """Implementation of ImageDisplayer using SIXEL."""
+
+    # total size the on-disk sixel cache may grow to before old blobs go
+    disk_cache_limit = 64 * 1024 * 1024
+
+    def __init__(self):
+        self.win = None
+        self.cache = {}
+        # secondary index: inode -> cache keys, so invalidating a path does
+        # not have to walk (and re-stat) the whole cache
+        self._by_inode = {}
+        self._magick_process = None
+        self._magick_lock = threading.Lock()
+        # conversions currently running, so concurrent requests for the same
+        # blob wait for one another instead of redoing the work
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._prefetch_pool = make_prefetch_pool()
+        self.fm.signal_bind('preview.cleared', lambda signal: self._clear_cache(signal.path))
+
+    def _cache_insert(self, cacheable, cached):
+        self.cache[cacheable] = cached
+        self._by_inode.setdefault(cacheable.inode, []).append(cacheable)
+
+    def _cache_evict(self, cacheable):
+        cached = self.cache.pop(cacheable, None)
+        if cached is not None and cached.fh is not None:
+            cached.image.close()
+            cached.fh.close()
+
+    def _clear_cache(self, path):
+        try:
+            inode = os.stat(path).st_ino
+        except OSError:
+            return
+        for cacheable in self._by_inode.pop(inode, ()):
+            self._cache_evict(cacheable)
+
+    def _magick_coprocess(self):
+        """Return a running persistent `magick -script` coprocess, respawning
+        it if the previous one died.  Returns None when ImageMagick < 7 is in
+        use (no script mode) or the process cannot be spawned."""
+        if magick_cmd()[0] != "magick":
+            return None
+        if self._magick_process is None or self._magick_process.poll() is not None:
+            environ = dict(os.environ)
+            environ.setdefault("MAGICK_OCL_DEVICE", "true")
+            try:
+                # We cannot close the process because that stops the preview.
+                # pylint: disable=consider-using-with
+                self._magick_process = Popen(
+                    [*magick_cmd(), "-script", "-"],
+                    stdin=PIPE,
+                    stdout=PIPE,
+                    stderr=DEVNULL,
+                    env=environ,
+                )
+            except OSError:
+                self._magick_process = None
+        return self._magick_process
+
+    def _convert_coprocess(self, path, fit_width, fit_height):
+        """Convert path by feeding a script block to the persistent
+        ImageMagick coprocess, amortizing its fork+exec+startup cost over all
+        thumbnails.  Returns the sixel bytes, or None if the coprocess is
+        unavailable or failed, in which case the caller falls back to a
+        one-shot process."""
+        proc = self._magick_coprocess()
+        if proc is None:
+            return None
+        script = (
+            '-define jpeg:size={double_width}x{double_height}\n'
+            '-read "{path}[0]"\n'
+            '-thumbnail "{width}x{height}>"\n'
+            '-dither {dithering}\n'
+            '-write sixel:fd:1\n'
+            '-delete 0--1\n'
+        ).format(
+            double_width=2 * fit_width,
+            double_height=2 * fit_height,
+            path=path.replace("\\", "\\\\").replace('"', '\\"'),
+            width=fit_width,
+            height=fit_height,
+            dithering=self.fm.settings.sixel_dithering,
+        )
+        with self._magick_lock:
+            try:
+                proc.stdin.write(os.fsencode(script))
+                proc.stdin.flush()
+                data = bytearray()
+                fd = proc.stdout.fileno()
+                # a sixel stream is framed by the protocol itself: it always
+                # ends with the string terminator ESC \
+                while not data.endswith(b'\x1b\\'):
+                    ready, _, _ = select.select([fd], [], [], 10)
+                    if not ready:
+                        raise OSError("magick coprocess timed out")
+                    chunk = os.read(fd, 65536)
+                    if not chunk:
+                        raise OSError("magick coprocess closed its stdout")
+                    data += chunk
+            except (OSError, ValueError):
+                proc.kill()
+                self._magick_process = None
+                return None
+        return bytes(data)
+
+    @staticmethod
+    def _disk_cache_dir():
+        """The directory holding converted sixel blobs across instances, or
+        None when there is no cache directory to use."""
+        if ranger.args is None or not getattr(ranger.args, "cachedir", None):
+            return None
+        return os.path.join(ranger.args.cachedir, "sixel")
+
+    # pylint: disable=too-many-positional-arguments
+    def _disk_cache_path(self, path, stat, fit_width, fit_height, dithering):
+        """Where the converted blob for this file and geometry lives on disk,
+        or None when the cache directory cannot be created."""
+        cache_dir = self._disk_cache_dir()
+        if cache_dir is None:
+            return None
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                return None
+        key = hashlib.blake2b(
+            "{0}\0{1}\0{2}\0{3}\0{4}\0{5}".format(
+                path, stat.st_size, stat.st_mtime, fit_width, fit_height, dithering
+            ).encode("utf-8", "surrogateescape"),
+            digest_size=16,
+        ).hexdigest()
+        return os.path.join(cache_dir, key)
+
+    def _trim_disk_cache(self):
+        """Evict the least recently read blobs until the on-disk cache fits
+        the size limit again."""
+        cache_dir = self._disk_cache_dir()
+        if cache_dir is None:
+            return
+        try:
+            entries = []
+            for name in os.listdir(cache_dir):
+                entry = os.path.join(cache_dir, name)
+                entries.append((os.stat(entry), entry))
+        except OSError:
+            return
+        total = sum(stat.st_size for stat, _ in entries)
+        entries.sort(key=lambda entry: entry[0].st_atime)
+        for stat, entry in entries:
+            if total <= self.disk_cache_limit:
+                break
+            try:
+                os.remove(entry)
+            except OSError:
+                continue
+            total -= stat.st_size
+
+    def _convert_one_shot(self, path, fit_width, fit_height, sixel_dithering):
+        """Convert path with a one-shot process; also the only conversion
+        path for ImageMagick < 7.  Returns the sixel bytes."""
+        environ = dict(os.environ)
+        environ.setdefault("MAGICK_OCL_DEVICE", "true")
+        try:
+            with Popen23(
+                [
+                    *magick_cmd(),
+                    # let libjpeg downscale in the DCT domain while
+                    # decoding; a noop for other formats
+                    "-define",
+                    "jpeg:size={0}x{1}".format(2 * fit_width, 2 * fit_height),
+                    path + "[0]",
+                    # -thumbnail resizes with a cheaper filter than
+                    # -geometry and strips metadata on the way
+                    "-thumbnail",
+                    "{0}x{1}>".format(fit_width, fit_height),
+                    "-dither",
+                    sixel_dithering,
+                    "sixel:-",
+                ],
+                stdout=PIPE,
+                stderr=DEVNULL,
+                env=environ,
+            ) as process:
+                data, _ = process.communicate()
+                if process.returncode != 0:
+                    raise ImageDisplayError("ImageMagick failed processing the SIXEL image")
+        except FileNotFoundError:
+            raise ImageDisplayError("SIXEL image previews require ImageMagick")
+        return data
+
+    def _store_disk_cache(self, disk_path, data):
+        """Atomically publish a converted blob into the on-disk cache; the
+        rename keeps concurrent ranger processes from reading half a file."""
+        try:
+            with NamedTemporaryFile(
+                dir=os.path.dirname(disk_path), delete=False
+            ) as tmpf:
+                tmpf.write(data)
+            os.replace(tmpf.name, disk_path)
+        except OSError:
+            pass
+
+    def _sixel_cache(self, path, width, height, use_coprocess=True):
+        stat = os.stat(path)
+        cacheable = _CacheableSixelImage(width, height, stat.st_ino)
+
+        while cacheable not in self.cache:
+            with self._inflight_lock:
+                event = self._inflight.get(cacheable)
+                claimed = event is None
+                if claimed:
+                    event = self._inflight[cacheable] = threading.Event()
+            if not claimed:
+                # another thread is already converting this very blob; wait
+                # for its cache insert instead of redoing the work
+                event.wait()
+                continue
+            try:
+                self._convert_into_cache(path, stat, cacheable, use_coprocess)
+            finally:
+                with self._inflight_lock:
+                    del self._inflight[cacheable]
+                event.set()
+
+        return self.cache[cacheable].image
+
+    def _convert_into_cache(self, path, stat, cacheable, use_coprocess):
+        """Produce the sixel blob for cacheable and insert it into the
+        in-memory cache, taking it from the on-disk cache when a previous
+        instance already converted this file."""
+        font_width, font_height = get_font_dimensions()
+        fit_width = font_width * cacheable.width
+        fit_height = font_height * cacheable.height
+
+        sixel_dithering = self.fm.settings.sixel_dithering
+        disk_path = self._disk_cache_path(
+            path, stat, fit_width, fit_height, sixel_dithering)
+        if disk_path is not None and os.path.isfile(disk_path):
+            # reuse the blob with no ImageMagick work at all
+            fobj = open(disk_path, "rb")  # pylint: disable=consider-using-with
+            self._cache_insert(cacheable, _CachedSixelImage(
+                mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ), fobj))
+            return
+
+        data = None
+        if use_coprocess:
+            data = self._convert_coprocess(path, fit_width, fit_height)
+        if data is None:
+            data = self._convert_one_shot(path, fit_width, fit_height, sixel_dithering)
+        if not data:
+            raise ImageDisplayError("ImageMagick produced an empty SIXEL image file")
+
+        if disk_path is not None:
+            # publish for future instances off the critical path; until
+            # then the in-memory bytes serve the draws
+            self._prefetch_pool.submit(self._store_disk_cache, disk_path, data)
+        self._cache_insert(cacheable, _CachedSixelImage(data, None))
+
+    # pylint: disable=too-many-positional-arguments
+    def draw(self, path, start_x, start_y, width, height):
+        if self.win is None:
+            self.win = self.fm.ui.win.subwin(height, width, start_y, start_x)
+        else:
+            self.win.mvwin(start_y, start_x)
+            self.win.resize(height, width)
+
+        with temporarily_moved_cursor(start_y, start_x):
+            sixel = self._sixel_cache(path, width, height)
+            if PY3:
+                sys.stdout.buffer.write(sixel)
+            else:
+                sys.stdout.write(sixel)
+            sys.stdout.flush()
+
+        # warm the cache for the files the cursor is likely to hit next
+        for neighbor in neighbor_image_paths(self.fm):
+            self._prefetch_pool.submit(self._prefetch, neighbor, width, height)
+
+    def _prefetch(self, path, width, height):
+        """Render path into the cache from a worker thread; failures are not
+        worth reporting for files nobody asked to see (yet).  One-shot
+        processes keep the workers off the coprocess lock, so a cache-miss
+        draw on the UI thread never queues behind neighbor conversions."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        if _CacheableSixelImage(width, height, stat.st_ino) in self.cache:
+            return
+        try:
+            self._sixel_cache(path, width, height, use_coprocess=False)
+        except (ImageDisplayError, OSError):
+            pass
+
+    def clear(self, start_x, start_y, width, height):
+        if self.win is not None:
+            self.win.clear()
+            self.win.refresh()
+
+            self.win = None
+
+        self.fm.ui.win.redrawwin()
+
+    def quit(self):
+        self.clear(0, 0, 0, 0)
+        for cached in self.cache.values():
+            if cached.fh is not None:
+                cached.image.close()
+                cached.fh.close()
+        self.cache = {}
+        self._by_inode = {}
+        self._inflight = {}
+        self._prefetch_pool.shutdown(wait=False)
+        if self._magick_process is not None and self._magick_process.poll() is None:
+            self._magick_process.kill()
+        self._magick_process = None
+        self._trim_disk_cache()
@@ -0,0 +1,80 @@
+# This file is part of ranger, the console file manager.
+# License: GNU GPL version 3, see the file "AUTHORS" for details.
+
+"""Image display using terminology's inline image support"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import sys
+
+from ranger.core.shared import FileManagerAware
+
+from . import (
+    ImageDisplayer,
+    register_image_displayer,
+    temporarily_moved_cursor,
+    write_all,
+)
+
+# CUP (cursor position) escape template, substituted per row when drawing
+_CUP = b"\x1b[%d;%dH"
+
+
+@register_image_displayer("terminology")
+class TerminologyImageDisplayer(ImageDisplayer, FileManagerAware):
+    """Implementation of ImageDisplayer using terminology image display support
+    (https://github.com/billiob/terminology).
+
+    Ranger must be running in terminology for this to work.
+    Doesn't work with TMUX :/
+    """
+
+    def __init__(self):
+        self.display_protocol = "\033"
+        self.close_protocol = "\000"
+        self._fd = sys.stdout.fileno()
+        self._drawn = False
+
+    # pylint: disable=too-many-positional-arguments
+    def draw(self, path, start_x, start_y, width, height):
+        # no dedupe against the previous draw here: a full UI redraw (e.g.
+        # Ctrl-L) erases the window without going through clear(), so an
+        # identical-looking draw can still be repainting a destroyed image
+        with temporarily_moved_cursor(start_y, start_x):
+            # Write intent
+            buf = bytearray(os.fsencode("%s}ic#%d;%d;%s%s" % (
+                self.display_protocol,
+                width, height,
+                path,
+                self.close_protocol)))
+
+            # Write Replacement commands ('#'); every row carries the same
+            # payload, so encode it once and position each copy with an
+            # inline CUP sequence: the frame grows in a single bytearray
+            # with no per-row string objects, and goes out in one write
+            row_bytes = os.fsencode("%s}ib%s%s%s}ie%s\n" % (  # needs a newline to work
+                self.display_protocol,
+                self.close_protocol,
+                "#" * width,
+                self.display_protocol,
+                self.close_protocol))
+            for y in range(0, height):
+                buf += _CUP % (start_y + y + 1, start_x + 1)
+                buf += row_bytes
+            # drain whatever the cursor moves left in the buffered stream,
+            # then hand the frame to the tty fd directly
+            sys.stdout.flush()
+            write_all(self._fd, bytes(buf))
+        self._drawn = True
+
+    def clear(self, start_x, start_y, width, height):
+        if not self._drawn:
+            # nothing on screen, so a full-window repaint would be wasted
+            return
+        self._drawn = False
+        self.fm.ui.win.redrawwin()
+        self.fm.ui.win.refresh()
+
+    def quit(self):
+        self.clear(0, 0, 0, 0)
@@ -0,0 +1,130 @@
+# This file is part of ranger, the console file manager.
+# License: GNU GPL version 3, see the file "AUTHORS" for details.
+
+"""Image display using ueberzug"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import json
+import os
+import queue
+import threading
+from subprocess import Popen, PIPE, TimeoutExpired
+
+from . import ImageDisplayer, register_image_displayer
+
+# the command schema is tiny and fixed, so the commands are %-formatted
+# directly instead of going through the generic json.dumps machinery;
+# only the path needs real escaping
+_escape = json.encoder.encode_basestring_ascii
+
+
+@register_image_displayer("ueberzug")
+class UeberzugImageDisplayer(ImageDisplayer):
+    """Implementation of ImageDisplayer using ueberzug.
+    Ueberzug can display images in a Xorg session.
+    Does not work over ssh.
+    """
+    IMAGE_ID = 'preview'
+    is_initialized = False
+
+    def __init__(self):
+        self.process = None
+        self._queue = None
+        self._last_args = None
+        self._add_line = (
+            '{"action": "add", "identifier": ' + _escape(self.IMAGE_ID)
+            + ', "x": %d, "y": %d, "max_width": %d, "max_height": %d, "path": %s}\n'
+        )
+        self._remove_line = (
+            '{"action": "remove", "identifier": ' + _escape(self.IMAGE_ID) + '}\n'
+        )
+
+    def initialize(self):
+        """start ueberzug"""
+        if (self.is_initialized and self.process.poll() is None
+                and not self.process.stdin.closed):
+            return
+
+        # We cannot close the process because that stops the preview.
+        # pylint: disable=consider-using-with
+        with open(os.devnull, "wb") as devnull:
+            self.process = Popen(
+                ["ueberzug", "layer", "--silent"],
+                cwd=self.working_dir,
+                stderr=devnull,
+                stdin=PIPE,
+                universal_newlines=True,
+            )
+        if self._queue is not None:
+            # stop the writer serving the previous (dead) process
+            self._queue.put(None)
+        # the fresh process has no image on screen, so a draw identical to
+        # the last one before the crash must not be skipped
+        self._last_args = None
+        self._queue = queue.Queue()
+        writer = threading.Thread(
+            target=self._writer_loop, args=(self._queue, self.process))
+        writer.daemon = True
+        writer.start()
+        self.is_initialized = True
+
+    @staticmethod
+    def _writer_loop(commands, process):
+        """Feed queued command lines to ueberzug from a dedicated thread, so
+        draw returns to the UI without blocking on the pipe.  Everything
+        queued by the time a write is due goes out in one write+flush, which
+        coalesces the add/remove bursts scrolling produces."""
+        while True:
+            line = commands.get()
+            if line is None:
+                return
+            lines = [line]
+            try:
+                while True:
+                    line = commands.get_nowait()
+                    if line is None:
+                        return
+                    lines.append(line)
+            except queue.Empty:
+                pass
+            try:
+                process.stdin.write("".join(lines))
+                process.stdin.flush()
+            except (OSError, ValueError):
+                # the process died; initialize() will start a fresh pair
+                return
+
+    def _write(self, line):
+        self.initialize()
+        self._queue.put(line)
+
+    def _execute(self, **kwargs):
+        """Generic fallback for commands without a precomposed template."""
+        self._write(json.dumps(kwargs) + '\n')
+
+    # pylint: disable=too-many-positional-arguments
+    def draw(self, path, start_x, start_y, width, height):
+        args = (path, start_x, start_y, width, height)
+        if args == self._last_args:
+            # the image is already on screen exactly like this; redrawing it
+            # would only make ueberzug flicker
+            return
+        self._write(self._add_line % (start_x, start_y, width, height, _escape(path)))
+        self._last_args = args
+
+    def clear(self, start_x, start_y, width, height):
+        self._last_args = None
+        if self.process and not self.process.stdin.closed:
+            self._write(self._remove_line)
+
+    def quit(self):
+        if self._queue is not None:
+            self._queue.put(None)
+        if self.is_initialized and self.process.poll() is None:
+            try:
+                self.process.terminate()
+                self.process.wait(timeout=1)
+            except TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
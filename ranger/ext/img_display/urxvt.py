@@ -0,0 +1,116 @@
+# This file is part of ranger, the console file manager.
+# License: GNU GPL version 3, see the file "AUTHORS" for details.
+
+"""Image display by setting the urxvt background image"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import sys
+
+from ranger.core.shared import FileManagerAware
+
+from . import ImageDisplayer, register_image_displayer, write_all
+
+
+@register_image_displayer("urxvt")
+class URXVTImageDisplayer(ImageDisplayer, FileManagerAware):
+    """Implementation of ImageDisplayer working by setting the urxvt
+    background image "under" the preview pane.
+
+    Ranger must be running in urxvt for this to work.
+
+    """
+
+    def __init__(self):
+        self.display_protocol = "\033"
+        self.close_protocol = "\a"
+        if os.environ["TERM"].startswith(("screen", "tmux")):
+            self.display_protocol += "Ptmux;\033\033"
+            self.close_protocol += "\033\\"
+        self.display_protocol += "]20;"
+        self._fd = sys.stdout.fileno()
+        # the protocol framing and the keep-aspect suffix never change, so
+        # draw only has to fill in the path and the four percentages
+        self._tmpl = (self.display_protocol
+                      + "%s;%dx%d+%d+%d:op=keep-aspect"
+                      + self.close_protocol)
+        self._clear_seq = os.fsencode(
+            self.display_protocol + ";100x100+1000+1000" + self.close_protocol)
+        # the pane percentages only depend on column_ratios, so they are
+        # computed once and dropped when that setting changes
+        self._cached_sizes = None
+        self.fm.settings.signal_bind(
+            'setopt.column_ratios',
+            lambda signal: setattr(self, '_cached_sizes', None))
+
+    @staticmethod
+    def _get_max_sizes():
+        """Use the whole terminal."""
+        pct_width = 100
+        pct_height = 100
+        return pct_width, pct_height
+
+    @staticmethod
+    def _get_centered_offsets():
+        """Center the image."""
+        pct_x = 50
+        pct_y = 50
+        return pct_x, pct_y
+
+    def _get_sizes(self):
+        """Return the width and height of the preview pane in relation to the
+        whole terminal window.
+
+        """
+        if self.fm.ui.pager.visible:
+            return self._get_max_sizes()
+
+        if self._cached_sizes is None:
+            total_columns_ratio = sum(self.fm.settings.column_ratios)
+            preview_column_ratio = self.fm.settings.column_ratios[-1]
+            pct_width = int((100 * preview_column_ratio) / total_columns_ratio)
+            pct_height = 100  # As much as possible while preserving the aspect ratio.
+            self._cached_sizes = pct_width, pct_height
+        return self._cached_sizes
+
+    def _get_offsets(self):
+        """Return the offsets of the image center."""
+        if self.fm.ui.pager.visible:
+            return self._get_centered_offsets()
+
+        pct_x = 100  # Right-aligned.
+        pct_y = 2    # TODO: Use the font size to calculate this offset.
+        return pct_x, pct_y
+
+    # pylint: disable=too-many-positional-arguments
+    def draw(self, path, start_x, start_y, width, height):
+        # The coordinates in the arguments are ignored as urxvt takes
+        # the coordinates in a non-standard way: the position of the
+        # image center as a percentage of the terminal size. As a
+        # result all values below are in percents.
+
+        pct_x, pct_y = self._get_offsets()
+        pct_width, pct_height = self._get_sizes()
+
+        write_all(self._fd, os.fsencode(
+            self._tmpl % (path, pct_width, pct_height, pct_x, pct_y)))
+
+    def clear(self, start_x, start_y, width, height):
+        write_all(self._fd, self._clear_seq)
+
+    def quit(self):
+        self.clear(0, 0, 0, 0)  # dummy assignments
+
+
+@register_image_displayer("urxvt-full")
+class URXVTImageFSDisplayer(URXVTImageDisplayer):
+    """URXVTImageDisplayer that utilizes the whole terminal."""
+
+    def _get_sizes(self):
+        """Use the whole terminal."""
+        return self._get_max_sizes()
+
+    def _get_offsets(self):
+        """Center the image."""
+        return self._get_centered_offsets()
@@ -0,0 +1,317 @@
+# This file is part of ranger, the console file manager.
+# License: GNU GPL version 3, see the file "AUTHORS" for details.
+
+"""Image display using w3mimgdisplay"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import errno
+import fcntl
+import os
+import select
+import struct
+import sys
+from subprocess import Popen, PIPE
+from time import sleep
+
+import termios
+
+from ranger.core.shared import FileManagerAware
+from ranger.ext.popen23 import Popen23
+
+from . import (
+    ImageDisplayer,
+    ImageDisplayError,
+    ImgDisplayUnsupportedException,
+    font_dimensions_generation,
+    probe_image_size,
+    register_image_displayer,
+)
+
+# precompiled winsize layout for the TIOCGWINSZ ioctl, so the format string
+# is not recompiled on every query
+_WINSZ = struct.Struct("HHHH")
+_WINSZ_ZERO = _WINSZ.pack(0, 0, 0, 0)
+
+W3MIMGDISPLAY_ENV = "W3MIMGDISPLAY_PATH"
+W3MIMGDISPLAY_OPTIONS = []
+W3MIMGDISPLAY_PATHS = [
+    '/usr/lib/w3m/w3mimgdisplay',
+    '/usr/libexec/w3m/w3mimgdisplay',
+    '/usr/lib64/w3m/w3mimgdisplay',
+    '/usr/libexec64/w3m/w3mimgdisplay',
+    '/usr/local/libexec/w3m/w3mimgdisplay',
+]
+
+
+@register_image_displayer("w3m")
+class W3MImageDisplayer(  # pylint: disable=too-many-instance-attributes
+        ImageDisplayer, FileManagerAware):
+    """Implementation of ImageDisplayer using w3mimgdisplay, an utilitary
+    program from w3m (a text-based web browser). w3mimgdisplay can display
+    images either in virtual tty (using linux framebuffer) or in a Xorg session.
+    Does not work over ssh.
+
+    w3m need to be installed for this to work.
+    """
+    is_initialized = False
+    # number of draws one w3mimgdisplay process serves before it is respawned
+    # to keep its memory leak in check
+    max_draws_per_process = 64
+    # resolved executable, shared by all instances once found
+    _cached_binary_path = None
+
+    def __init__(self):
+        self.binary_path = None
+        self.process = None
+        self._font_dims = None
+        self._font_dims_generation = -1
+        self._draws_since_spawn = 0
+        self._pending_acks = 0
+        self._pending = []
+
+    def initialize(self):
+        """start w3mimgdisplay"""
+        if self.binary_path is None:
+            self.binary_path = self._find_w3mimgdisplay_executable()  # may crash
+        # We cannot close the process because that stops the preview.
+        # pylint: disable=consider-using-with
+        # binary pipes: the protocol is ASCII numeric plus filenames, so the
+        # TextIOWrapper codec layer universal_newlines inserts would only
+        # transcode every exchange for nothing
+        self.process = Popen([self.binary_path] + W3MIMGDISPLAY_OPTIONS, cwd=self.working_dir,
+                             stdin=PIPE, stdout=PIPE)
+        self.is_initialized = True
+        self._draws_since_spawn = 0
+        self._pending_acks = 0
+        del self._pending[:]
+
+    @classmethod
+    def _find_w3mimgdisplay_executable(cls):
+        if cls._cached_binary_path is not None:
+            return cls._cached_binary_path
+        paths = [os.environ.get(W3MIMGDISPLAY_ENV, None)] + W3MIMGDISPLAY_PATHS
+        for path in paths:
+            # one access(2) call checks both existence and executability
+            if path is not None and os.access(path, os.X_OK):
+                cls._cached_binary_path = path
+                return path
+        raise ImageDisplayError("No w3mimgdisplay executable found.  Please set "
+                                "the path manually by setting the %s environment variable.  (see "
+                                "man page)" % W3MIMGDISPLAY_ENV)
+
+    def _get_font_dimensions(self):
+        # Get the height and width of a character displayed in the terminal in
+        # pixels.  This can be an ioctl plus a `w3mimgdisplay -test` run, and
+        # draw and clear both need it, so the result is kept until the next
+        # terminal resize bumps the generation counter.
+        generation = font_dimensions_generation()
+        if self._font_dims is not None and self._font_dims_generation == generation:
+            return self._font_dims
+        if self.binary_path is None:
+            self.binary_path = self._find_w3mimgdisplay_executable()
+        fd_stdout = sys.stdout.fileno()
+        fretint = fcntl.ioctl(fd_stdout, termios.TIOCGWINSZ, _WINSZ_ZERO)
+        rows, cols, xpixels, ypixels = _WINSZ.unpack(fretint)
+        if xpixels == 0 and ypixels == 0:
+            with Popen23(
+                [self.binary_path, "-test"],
+                stdout=PIPE,
+            ) as process:
+                output, _ = process.communicate()
+            output = output.split()
+            xpixels, ypixels = int(output[0]), int(output[1])
+            # adjust for misplacement
+            xpixels += 2
+            ypixels += 2
+
+        self._font_dims = (xpixels // cols), (ypixels // rows)
+        self._font_dims_generation = generation
+        return self._font_dims
+
+    def _drain_replies(self):
+        """Consume acknowledgments w3mimgdisplay already produced for earlier
+        commands, without blocking.  Every '3;' sync elicits exactly one
+        reply line, so counting outstanding ones keeps the pipe in step."""
+        while self._pending_acks:
+            ready, _, _ = select.select([self.process.stdout], [], [], 0)
+            if not ready:
+                break
+            self.process.stdout.readline()
+            self._pending_acks -= 1
+
+    def _sync_replies(self):
+        """Block until every outstanding acknowledgment has been read; needed
+        before an exchange whose reply actually carries data."""
+        while self._pending_acks:
+            self.process.stdout.readline()
+            self._pending_acks -= 1
+
+    def _flush_pending(self):
+        """Send every buffered command block in a single write; each block
+        ends with a '3;' sync, so each owes us one reply line."""
+        if not self._pending:
+            return
+        data = b''.join(self._pending)
+        acks = len(self._pending)
+        del self._pending[:]
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+        # the replies to the '3;' syncs carry no data, so don't wait for
+        # them here; they are drained before the next command instead
+        self._pending_acks += acks
+
+    # pylint: disable=too-many-positional-arguments
+    def draw(self, path, start_x, start_y, width, height):
+        if not self.is_initialized or self.process.poll() is not None:
+            self.initialize()
+        self._drain_replies()
+        try:
+            input_gen = self._generate_w3m_input(path, start_x, start_y, width,
+                                                 height)
+        except (ImageDisplayError, ImgDisplayUnsupportedException, OSError):
+            # a clear that deferred to this draw must not die with it
+            self._flush_pending()
+            raise
+        self._pending.append(os.fsencode(input_gen))
+        self._flush_pending()
+
+        # Mitigate the issue with the horizontal black bars when
+        # selecting some images on some systems. 2 milliseconds seems
+        # enough. Adjust as necessary.
+        if self.fm.settings.w3m_delay > 0:
+            sleep(self.fm.settings.w3m_delay)
+
+        # HACK workaround for w3mimgdisplay memory leak: the process used to
+        # be torn down after every draw, turning each preview into a
+        # fork+exec.  Keeping it alive and respawning it every
+        # max_draws_per_process draws bounds the leak just as well while
+        # amortizing the spawn cost.
+        self._draws_since_spawn += 1
+        if self._draws_since_spawn >= self.max_draws_per_process:
+            self.quit()
+            self.is_initialized = False
+
+    def clear(self, start_x, start_y, width, height):
+        if not self.is_initialized or self.process.poll() is not None:
+            self.initialize()
+
+        fontw, fonth = self._get_font_dimensions()
+
+        cmd = "6;{x};{y};{w};{h}\n4;\n3;\n".format(
+            x=int((start_x - 0.2) * fontw),
+            y=start_y * fonth,
+            # y = int((start_y + 1) * fonth), # (for tmux top status bar)
+            w=int((width + 0.4) * fontw),
+            h=height * fonth + 1,
+            # h = (height - 1) * fonth + 1, # (for tmux top status bar)
+        )
+
+        self._drain_replies()
+        self.fm.ui.win.redrawwin()
+        self._pending.append(cmd.encode('ascii'))
+        if self._draw_will_follow():
+            # the image draw queued for this main-loop cycle picks the
+            # clear up in a single write
+            return
+        try:
+            self._flush_pending()
+        except IOError as ex:
+            if ex.errno == errno.EPIPE:
+                return
+            raise
+
+    def _draw_will_follow(self):
+        """Whether an image draw is queued for this main-loop cycle, which
+        would pick pending command blocks up.  Mirrors the dispatch in
+        UI.draw_images and the condition in Pager.draw_image, so a clear
+        defers only when that draw really is coming (e.g. not when the
+        taskview or pager covers a preview without replacing it)."""
+        ui = self.fm.ui
+        if ui.pager.visible:
+            pager = ui.pager
+        elif ui.browser.pager:
+            if ui.browser.pager.visible:
+                pager = ui.browser.pager
+            else:
+                pager = ui.browser.columns[-1]
+        else:
+            return False
+        return bool(pager.image) and pager.need_redraw_image
+
+    def _probe_image_size(self, path):
+        """Image size without a w3mimgdisplay round trip: for the common
+        formats the header is parsed in-process, then PIL gets a go if it is
+        installed; only as a last resort is the synchronous '5;' exchange
+        with the subprocess used."""
+        try:
+            width, height = probe_image_size(path)
+        except OSError:
+            width, height = 0, 0
+        if width > 0 and height > 0:
+            return width, height
+
+        try:
+            import PIL.Image
+            with PIL.Image.open(path) as image:
+                # Image.open is lazy, this only parses the header
+                return image.size
+        except (ImportError, OSError):
+            pass
+
+        # this exchange does need the reply, so all outstanding
+        # acknowledgments have to be consumed first
+        self._sync_replies()
+        cmd = "5;{path}\n".format(path=path)
+        self.process.stdin.write(os.fsencode(cmd))
+        self.process.stdin.flush()
+        # int() accepts ASCII digits as bytes, no decode needed
+        output = self.process.stdout.readline().split()
+
+        if len(output) != 2:
+            raise ImageDisplayError('Failed to execute w3mimgdisplay', output)
+
+        return int(output[0]), int(output[1])
+
+    # pylint: disable=too-many-positional-arguments
+    def _generate_w3m_input(self, path, start_x, start_y, max_width, max_height):
+        """Prepare the input string for w3mimgpreview
+
+        start_x, start_y, max_height and max_width specify the drawing area.
+        They are expressed in number of characters.
+        """
+        fontw, fonth = self._get_font_dimensions()
+        if fontw == 0 or fonth == 0:
+            raise ImgDisplayUnsupportedException
+
+        max_width_pixels = max_width * fontw
+        max_height_pixels = max_height * fonth - 2
+        # (for tmux top status bar)
+        # max_height_pixels = (max_height - 1) * fonth - 2
+
+        # get image size
+        width, height = self._probe_image_size(path)
+
+        # get the maximum image size preserving ratio
+        if width > max_width_pixels:
+            height = (height * max_width_pixels) // width
+            width = max_width_pixels
+        if height > max_height_pixels:
+            width = (width * max_height_pixels) // height
+            height = max_height_pixels
+
+        start_x = int((start_x - 0.2) * fontw) + self.fm.settings.w3m_offset
+        start_y = (start_y * fonth) + self.fm.settings.w3m_offset
+
+        return "0;1;{x};{y};{w};{h};;;;;{filename}\n4;\n3;\n".format(
+            x=start_x,
+            y=start_y,
+            # y = (start_y + 1) * fonth, # (for tmux top status bar)
+            w=width,
+            h=height,
+            filename=path,
+        )
+
+    def quit(self):
+        if self.is_initialized and self.process and self.process.poll() is None:
+            self.process.kill()
@@ -10,6 +10,7 @@ import curses
 from subprocess import CalledProcessError
 
 from ranger.ext.get_executables import get_executables
+from ranger.ext.img_display import invalidate_font_dimensions
 from ranger.ext.keybinding_parser import KeyBuffer, KeyMaps, ALT_KEY
 from ranger.ext.lazy_property import lazy_property
 from ranger.ext.signals import Signal
@@ -351,6 +352,7 @@ class UI(  # pylint: disable=too-many-instance-attributes,too-many-public-method
 
     def update_size(self):
         """resize all widgets"""
+        invalidate_font_dimensions()
         self.termsize = self.win.getmaxyx()
         y, x = self.termsize
 
@@ -128,6 +128,7 @@ def main():
             'ranger.container',
             'ranger.core',
             'ranger.ext',
+            'ranger.ext.img_display',
             'ranger.ext.vcs',
             'ranger.gui',
             'ranger.gui.widgets',